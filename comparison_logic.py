@@ -1,13 +1,36 @@
 import pandas as pd
+import numpy as np
 import io
+import re
 from datetime import datetime
+from functools import lru_cache
+
+# Month columns expected in 'Monthly Data in Columns' ingestion files
+MONTH_COLUMNS = ('Apr-24', 'May-24', 'Jun-24', 'Jul-24', 'Aug-24', 'Sep-24', 'Oct-24', 'Nov-24', 'Dec-24', 'Jan-25', 'Feb-25')
+
+# Matches any column name containing one of the month columns (e.g. 'Apr-24' or 'Apr-24.1')
+MONTH_COLUMN_PATTERN = re.compile('|'.join(re.escape(month) for month in MONTH_COLUMNS))
+
+# xlsxwriter options for the Excel exports: constant memory mode flushes every row to disk
+# as soon as it is written, so memory use does not grow with the number of rows
+EXCEL_WRITER_OPTIONS = {
+    'constant_memory': True,
+    'default_date_format': 'yyyy-mm-dd hh:mm:ss'
+}
+
+# Match status categories of the resource comparison results
+MATCH_STATUS_CATEGORIES = ['Match', 'Mismatch', 'No Match in Raw Data']
 
 # =============================================================================
 # COMPARISON LOGIC FUNCTIONS
 # =============================================================================
 
-def compare_facility_names(raw_data_df, ingestion_df):
-    """Compare Facility Name columns between raw data and ingestion files"""
+def compare_facility_names(raw_data_df, ingestion_df, include_missing_lists=True, max_missing_display=None):
+    """Compare Facility Name columns between raw data and ingestion files
+    
+    Missing facilities are returned as pd.Index objects; they are left out when include_missing_lists
+    is False and capped at max_missing_display names when set (the counts always cover every facility).
+    """
     try:
         # Check if Facility Name column exists in raw data file
         if 'Facility Name' not in raw_data_df.columns:
@@ -22,43 +45,67 @@ def compare_facility_names(raw_data_df, ingestion_df):
         else:
             return {'error': 'Neither Facility Name nor Facility column found in ingestion file'}
         
-        # Get unique facility names from both files
-        raw_facilities = set(raw_data_df['Facility Name'].dropna())
-        ingestion_facilities = set(ingestion_df[ingestion_facility_col].dropna())
+        # Get unique facility names from both files (as indexes, so set operations run on pandas hashtables)
+        raw_facilities = pd.Index(raw_data_df['Facility Name'].dropna().unique())
+        ingestion_facilities = pd.Index(ingestion_df[ingestion_facility_col].dropna().unique())
         
         # Find missing facilities
-        missing_in_raw = ingestion_facilities - raw_facilities
-        missing_in_ingestion = raw_facilities - ingestion_facilities
+        missing_in_raw = ingestion_facilities.difference(raw_facilities)
+        missing_in_ingestion = raw_facilities.difference(ingestion_facilities)
         
-        return {
+        result = {
             'raw_facilities_count': len(raw_facilities),
             'ingestion_facilities_count': len(ingestion_facilities),
-            'common_facilities_count': len(raw_facilities & ingestion_facilities),
-            'missing_in_raw': list(missing_in_raw),
-            'missing_in_ingestion': list(missing_in_ingestion),
+            'common_facilities_count': len(raw_facilities.intersection(ingestion_facilities)),
             'missing_in_raw_count': len(missing_in_raw),
             'missing_in_ingestion_count': len(missing_in_ingestion)
         }
+        
+        # Only return the (possibly very long) missing facility indexes when they are wanted
+        if include_missing_lists:
+            result['missing_in_raw'] = missing_in_raw[:max_missing_display]
+            result['missing_in_ingestion'] = missing_in_ingestion[:max_missing_display]
+        
+        return result
     except Exception as e:
         return {'error': f'Error comparing facility names: {str(e)}'}
 
+def convert_key_columns_to_categorical(raw_data_df, ingestion_df):
+    """Convert facility and resource columns of both files (in place) to categoricals with shared categories"""
+    # Pairs of (raw data column, ingestion column candidates) that are compared between the files
+    key_column_pairs = [
+        ('Facility Name', ['Facility Name', 'Facility']),
+        ('Resource Name', ['Resource Name', 'Resource'])
+    ]
+    
+    for raw_col, ingestion_candidates in key_column_pairs:
+        ingestion_col = next((col for col in ingestion_candidates if col in ingestion_df.columns), None)
+        if raw_col not in raw_data_df.columns or ingestion_col is None:
+            continue
+        
+        # Only convert text columns of the same dtype; mixing e.g. names and numeric IDs in one set of
+        # categories would give categoricals that cannot be converted to Arrow for display
+        raw_values, ingestion_values = raw_data_df[raw_col], ingestion_df[ingestion_col]
+        if raw_values.dtype != ingestion_values.dtype or not all(
+            pd.api.types.infer_dtype(values, skipna=True) == 'string' for values in (raw_values, ingestion_values)
+        ):
+            continue
+        
+        # Sharing the categories lets comparisons and merges work on the integer category codes
+        categories = pd.Index(pd.concat([raw_values, ingestion_values]).dropna().unique())
+        key_dtype = pd.CategoricalDtype(categories)
+        raw_data_df[raw_col] = raw_data_df[raw_col].astype(key_dtype)
+        ingestion_df[ingestion_col] = ingestion_df[ingestion_col].astype(key_dtype)
+
 def create_missing_facilities_excel(missing_facilities, filename="missing_facilities.xlsx"):
     """Create Excel file with missing facilities list"""
     try:
-        # Create DataFrame with missing facilities
-        df = pd.DataFrame({
-            'Missing Facilities': missing_facilities,
-            'Status': 'Not Found in Raw Data'
-        })
-        
-        # Create Excel file in memory
+        # Create Excel file in memory, flushing each row as it is written
         output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            df.to_excel(writer, sheet_name='Missing Facilities', index=False)
-            
+        with pd.ExcelWriter(output, engine='xlsxwriter', engine_kwargs={'options': EXCEL_WRITER_OPTIONS}) as writer:
             # Get the workbook and worksheet objects
             workbook = writer.book
-            worksheet = writer.sheets['Missing Facilities']
+            worksheet = workbook.add_worksheet('Missing Facilities')
             
             # Add some formatting
             header_format = workbook.add_format({
@@ -69,10 +116,14 @@ def create_missing_facilities_excel(missing_facilities, filename="missing_facili
                 'border': 1
             })
             
-            # Write header
+            # Write header (constant memory mode requires rows to be written in order)
             worksheet.write('A1', 'Missing Facilities', header_format)
             worksheet.write('B1', 'Status', header_format)
             
+            # Write data rows straight from the missing facilities
+            for row_num, facility in enumerate(missing_facilities, start=1):
+                worksheet.write_row(row_num, 0, (facility, 'Not Found in Raw Data'))
+            
             # Set column widths
             worksheet.set_column('A:A', 30)
             worksheet.set_column('B:B', 20)
@@ -82,27 +133,33 @@ def create_missing_facilities_excel(missing_facilities, filename="missing_facili
     except Exception as e:
         return None
 
-def compare_dataframes(raw_data_df, ingestion_df):
+def compare_dataframes(raw_data_df, ingestion_df, ingestion_type=None, include_missing_lists=True, max_missing_display=None):
     """Compare raw data and ingestion DataFrames and return analysis results"""
+    # Column name sets, built once and shared by the comparisons below
+    raw_cols = set(raw_data_df.columns)
+    ing_cols = set(ingestion_df.columns)
+    
     # Basic comparison info
     basic_info = {
         'raw_data_rows': len(raw_data_df),
         'ingestion_rows': len(ingestion_df),
         'raw_data_cols': len(raw_data_df.columns),
         'ingestion_cols': len(ingestion_df.columns),
-        'common_columns': list(set(raw_data_df.columns) & set(ingestion_df.columns)),
-        'raw_data_only_columns': list(set(raw_data_df.columns) - set(ingestion_df.columns)),
-        'ingestion_only_columns': list(set(ingestion_df.columns) - set(raw_data_df.columns)),
+        'common_columns': list(raw_cols & ing_cols),
+        'raw_data_only_columns': list(raw_cols - ing_cols),
+        'ingestion_only_columns': list(ing_cols - raw_cols),
         'row_difference': len(raw_data_df) - len(ingestion_df),
         'missing_in_ingestion': len(raw_data_df) - len(ingestion_df) if len(raw_data_df) > len(ingestion_df) else 0
     }
     
     # Facility name comparison
-    facility_comparison = compare_facility_names(raw_data_df, ingestion_df)
+    facility_comparison = compare_facility_names(raw_data_df, ingestion_df, include_missing_lists, max_missing_display)
     
     # Resource type identification
     resource_type = identify_resource_type(ingestion_df)
-    ingestion_file_type = identify_ingestion_file_type(ingestion_df)
+    ingestion_file_type = ingestion_type
+    if ingestion_file_type is None:
+        ingestion_file_type = identify_ingestion_file_type(ingestion_df)
     
     # Resource-specific comparison (currently only GHG Emissions)
     resource_comparison = None
@@ -121,14 +178,12 @@ def compare_dataframes(raw_data_df, ingestion_df):
 def create_duplicate_rows_excel(duplicate_df, filename="duplicate_rows.xlsx"):
     """Create Excel file with duplicate rows list"""
     try:
-        # Create Excel file in memory
+        # Create Excel file in memory, flushing each row as it is written
         output = io.BytesIO()
-        with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-            duplicate_df.to_excel(writer, sheet_name='Duplicate Rows', index=False)
-            
+        with pd.ExcelWriter(output, engine='xlsxwriter', engine_kwargs={'options': EXCEL_WRITER_OPTIONS}) as writer:
             # Get the workbook and worksheet objects
             workbook = writer.book
-            worksheet = writer.sheets['Duplicate Rows']
+            worksheet = workbook.add_worksheet('Duplicate Rows')
             
             # Add some formatting
             header_format = workbook.add_format({
@@ -139,78 +194,88 @@ def create_duplicate_rows_excel(duplicate_df, filename="duplicate_rows.xlsx"):
                 'border': 1
             })
             
-            # Write header with formatting
-            for col_num, column in enumerate(duplicate_df.columns):
-                worksheet.write(0, col_num, column, header_format)
+            # Write header with formatting (constant memory mode requires rows to be written in order)
+            worksheet.write_row(0, 0, list(duplicate_df.columns), header_format)
+            
+            # Write data rows
+            for row_num, row in enumerate(_excel_rows(duplicate_df), start=1):
+                worksheet.write_row(row_num, 0, row)
             
             # Set column widths
-            for col_num, column in enumerate(duplicate_df.columns):
-                worksheet.set_column(col_num, col_num, 20)
+            worksheet.set_column(0, len(duplicate_df.columns) - 1, 20)
         
         output.seek(0)
         return output.getvalue()
     except Exception as e:
         return None
 
-def analyze_data_quality(raw_data_df, ingestion_df):
+def _excel_rows(df):
+    """Yield DataFrame rows as plain Python tuples, with missing values as empty cells"""
+    # Rows are converted one at a time so no object copy of the whole DataFrame is built
+    for row in df.itertuples(index=False, name=None):
+        yield tuple(None if pd.isna(value) else value for value in row)
+
+def analyze_data_quality(raw_data_df, ingestion_df, ingestion_type=None):
     """Analyze data quality issues in ingestion data only"""
     quality_issues = []
     duplicate_rows = None
     
-    # Identify ingestion file type to determine which columns to check
-    ingestion_type = identify_ingestion_file_type(ingestion_df)
+    # Identify ingestion file type (unless already known) to determine which columns to check
+    if ingestion_type is None:
+        ingestion_type = identify_ingestion_file_type(ingestion_df)
     
     if ingestion_type == 'Monthly Data in Rows':
-        # For Type 1: Check all columns except Quantity for null values
-        columns_to_check = [col for col in ingestion_df.columns if col != 'Quantity']
+        # For Type 1: Check all columns except Quantity for null values and duplicates
+        key_columns = [col for col in ingestion_df.columns if col != 'Quantity']
         
         # Check for null values in all columns except Quantity
-        for col in columns_to_check:
-            null_count = ingestion_df[col].isnull().sum()
-            if null_count > 0:
-                quality_issues.append(f"Ingestion data has {null_count} null values in '{col}' column")
+        null_counts = ingestion_df[key_columns].isnull().sum()
+        for col, null_count in null_counts[null_counts > 0].items():
+            quality_issues.append(f"Ingestion data has {null_count} null values in '{col}' column")
         
         # Check for duplicates (all columns except Quantity)
-        duplicate_columns = [col for col in ingestion_df.columns if col != 'Quantity']
-        duplicates = ingestion_df.duplicated(subset=duplicate_columns).sum()
-        if duplicates > 0:
-            quality_issues.append(f"Ingestion data has {duplicates} duplicate rows (same values in all columns except Quantity)")
+        duplicate_mask = ingestion_df.duplicated(subset=key_columns, keep=False)
+        if duplicate_mask.any():
             # Get the actual duplicate rows
-            duplicate_rows = ingestion_df[ingestion_df.duplicated(subset=duplicate_columns, keep=False)]
+            duplicate_rows = ingestion_df[duplicate_mask]
+            # Count every occurrence after the first one, only hashing the duplicate rows again
+            duplicates = len(duplicate_rows) - len(duplicate_rows.drop_duplicates(subset=key_columns))
+            quality_issues.append(f"Ingestion data has {duplicates} duplicate rows (same values in all columns except Quantity)")
     
     elif ingestion_type == 'Monthly Data in Columns':
-        # For Type 2: Check all columns except month columns for null values
+        # For Type 2: Check all columns except month columns for null values and duplicates
         # Month columns are like Apr-24, May-24, etc.
-        month_columns = [col for col in ingestion_df.columns if any(month in col for month in ['Apr-24', 'May-24', 'Jun-24', 'Jul-24', 'Aug-24', 'Sep-24', 'Oct-24', 'Nov-24', 'Dec-24', 'Jan-25', 'Feb-25'])]
-        columns_to_check = [col for col in ingestion_df.columns if col not in month_columns]
+        month_columns = {col for col in ingestion_df.columns if MONTH_COLUMN_PATTERN.search(col)}
+        key_columns = [col for col in ingestion_df.columns if col not in month_columns]
         
         # Check for null values in all columns except month columns
-        for col in columns_to_check:
-            null_count = ingestion_df[col].isnull().sum()
-            if null_count > 0:
-                quality_issues.append(f"Ingestion data has {null_count} null values in '{col}' column")
+        null_counts = ingestion_df[key_columns].isnull().sum()
+        for col, null_count in null_counts[null_counts > 0].items():
+            quality_issues.append(f"Ingestion data has {null_count} null values in '{col}' column")
         
         # Check for duplicates (all columns except month columns)
-        duplicate_columns = [col for col in ingestion_df.columns if col not in month_columns]
-        duplicates = ingestion_df.duplicated(subset=duplicate_columns).sum()
-        if duplicates > 0:
-            quality_issues.append(f"Ingestion data has {duplicates} duplicate rows (same values in all columns except month columns)")
+        duplicate_mask = ingestion_df.duplicated(subset=key_columns, keep=False)
+        if duplicate_mask.any():
             # Get the actual duplicate rows
-            duplicate_rows = ingestion_df[ingestion_df.duplicated(subset=duplicate_columns, keep=False)]
+            duplicate_rows = ingestion_df[duplicate_mask]
+            # Count every occurrence after the first one, only hashing the duplicate rows again
+            duplicates = len(duplicate_rows) - len(duplicate_rows.drop_duplicates(subset=key_columns))
+            quality_issues.append(f"Ingestion data has {duplicates} duplicate rows (same values in all columns except month columns)")
     
     else:
         # For unknown types, check all columns for null values
-        for col in ingestion_df.columns:
-            null_count = ingestion_df[col].isnull().sum()
-            if null_count > 0:
-                quality_issues.append(f"Ingestion data has {null_count} null values in '{col}' column")
+        null_counts = ingestion_df.isnull().sum()
+        for col, null_count in null_counts[null_counts > 0].items():
+            quality_issues.append(f"Ingestion data has {null_count} null values in '{col}' column")
         
         # Check for complete duplicates
-        duplicates = ingestion_df.duplicated().sum()
-        if duplicates > 0:
-            quality_issues.append(f"Ingestion data has {duplicates} completely duplicate rows")
+        duplicate_mask = ingestion_df.duplicated(keep=False)
+        if duplicate_mask.any():
             # Get the actual duplicate rows
-            duplicate_rows = ingestion_df[ingestion_df.duplicated(keep=False)]
+            duplicate_rows = ingestion_df[duplicate_mask]
+            # Count every occurrence after the first one, only hashing the duplicate rows again
+            duplicates = len(duplicate_rows) - len(duplicate_rows.drop_duplicates())
+            quality_issues.append(f"Ingestion data has {duplicates} completely duplicate rows")
     
     return {
         'quality_issues': quality_issues,
@@ -229,51 +294,92 @@ def find_data_discrepancies(raw_data_df, ingestion_df):
 def identify_resource_type(ingestion_df):
     """Identify resource type based on column indicators in ingestion file"""
     try:
-        # Check for GHG Emissions indicator (Scope column)
-        if 'Scope' in ingestion_df.columns:
-            return 'GHG Emissions'
-        
-        # Add other resource type indicators here as needed
-        # if 'Water' in ingestion_df.columns:
-        #     return 'Water'
-        # if 'Waste' in ingestion_df.columns:
-        #     return 'Waste'
-        # if 'Activity' in ingestion_df.columns:
-        #     return 'Activity Metrics'
-        
-        return 'Unknown'
+        return _identify_resource_type_cached(tuple(ingestion_df.columns))
     except Exception as e:
         return f'Error identifying resource type: {str(e)}'
 
+@lru_cache(maxsize=32)
+def _identify_resource_type_cached(columns):
+    """Identify resource type from a tuple of column names (cached per column layout)"""
+    # Check for GHG Emissions indicator (Scope column)
+    if 'Scope' in columns:
+        return 'GHG Emissions'
+    
+    # Add other resource type indicators here as needed
+    # if 'Water' in columns:
+    #     return 'Water'
+    # if 'Waste' in columns:
+    #     return 'Waste'
+    # if 'Activity' in columns:
+    #     return 'Activity Metrics'
+    
+    return 'Unknown'
+
 def identify_ingestion_file_type(ingestion_df):
     """Identify the type of ingestion file based on column structure"""
     try:
-        columns = list(ingestion_df.columns)
-        
-        # Monthly Data in Rows: Facility Name/Facility, Scope, Activity Type, Month, Year, Quantity, Unit, Resource Name
-        type1_indicators = ['Scope', 'Activity Type', 'Month', 'Year', 'Quantity', 'Unit', 'Resource Name']
-        
-        # Monthly Data in Columns: Facility Name/Facility, Scope, Activity Type, Resource, Apr-24, May-24, Jun-24, Jul-24, Aug-24, Sep-24, Oct-24, Nov-24, Dec-24, Jan-25, Feb-25, Units
-        type2_indicators = ['Scope', 'Activity Type', 'Resource', 'Units']
-        
-        # Check for facility column (either Facility Name or Facility)
-        has_facility = 'Facility Name' in columns or 'Facility' in columns
-        
-        # Check for Monthly Data in Rows (monthly data with Month/Year columns)
-        if has_facility and all(col in columns for col in type1_indicators):
-            return 'Monthly Data in Rows'
-        
-        # Check for Monthly Data in Columns (monthly columns structure)
-        if has_facility and all(col in columns for col in type2_indicators):
-            # Check if there are month columns (Apr-24, May-24, etc.)
-            month_columns = [col for col in columns if any(month in col for month in ['Apr-24', 'May-24', 'Jun-24', 'Jul-24', 'Aug-24', 'Sep-24', 'Oct-24', 'Nov-24', 'Dec-24', 'Jan-25', 'Feb-25'])]
-            if len(month_columns) >= 3:  # At least 3 month columns
-                return 'Monthly Data in Columns'
-        
-        return 'Unknown'
+        return _identify_ingestion_file_type_cached(tuple(ingestion_df.columns))
     except Exception as e:
         return f'Error identifying ingestion file type: {str(e)}'
 
+@lru_cache(maxsize=32)
+def _identify_ingestion_file_type_cached(columns):
+    """Identify the ingestion file type from a tuple of column names (cached per column layout)"""
+    # Monthly Data in Rows: Facility Name/Facility, Scope, Activity Type, Month, Year, Quantity, Unit, Resource Name
+    type1_indicators = ['Scope', 'Activity Type', 'Month', 'Year', 'Quantity', 'Unit', 'Resource Name']
+    
+    # Monthly Data in Columns: Facility Name/Facility, Scope, Activity Type, Resource, Apr-24, May-24, Jun-24, Jul-24, Aug-24, Sep-24, Oct-24, Nov-24, Dec-24, Jan-25, Feb-25, Units
+    type2_indicators = ['Scope', 'Activity Type', 'Resource', 'Units']
+    
+    # Check for facility column (either Facility Name or Facility)
+    has_facility = 'Facility Name' in columns or 'Facility' in columns
+    
+    # Check for Monthly Data in Rows (monthly data with Month/Year columns)
+    if has_facility and all(col in columns for col in type1_indicators):
+        return 'Monthly Data in Rows'
+    
+    # Check for Monthly Data in Columns (monthly columns structure)
+    if has_facility and all(col in columns for col in type2_indicators):
+        # Check if there are month columns (Apr-24, May-24, etc.)
+        month_columns = [col for col in columns if MONTH_COLUMN_PATTERN.search(col)]
+        if len(month_columns) >= 3:  # At least 3 month columns
+            return 'Monthly Data in Columns'
+    
+    return 'Unknown'
+
+def _align_key_dtypes(left, right, key_columns):
+    """Give key columns that are numeric in one frame and text in the other a common dtype, so the frames can be merged"""
+    left_keys, right_keys = {}, {}
+    for col in key_columns:
+        if pd.api.types.is_numeric_dtype(left[col]) == pd.api.types.is_numeric_dtype(right[col]):
+            continue
+        if col == 'Year':
+            # Years stored as text in one file compare as numbers (text that is not a year never matches)
+            left_keys[col] = pd.to_numeric(left[col], errors='coerce')
+            right_keys[col] = pd.to_numeric(right[col], errors='coerce')
+        else:
+            # Other keys compare as text (e.g. a Month of 4 never matches 'April'), keeping missing values missing
+            left_keys[col] = left[col].astype(str).where(left[col].notna())
+            right_keys[col] = right[col].astype(str).where(right[col].notna())
+    return left.assign(**left_keys), right.assign(**right_keys)
+
+def _numeric_quantities(quantities):
+    """Return quantities as numbers; in a column mixing numbers and text (e.g. 'TBD') the text is read as missing"""
+    if pd.api.types.is_numeric_dtype(quantities):
+        return quantities
+    return pd.to_numeric(quantities, errors='coerce')
+
+def _match_status(merged, ingestion_quantity_col):
+    """Categorical match status for each row of an indicator merge of ingestion against raw data quantities"""
+    # Missing quantities (NA in Arrow-backed columns) count as mismatches
+    quantities_match = merged['raw_quantity'].eq(merged[ingestion_quantity_col]).fillna(False).to_numpy(dtype=bool)
+    match_status = np.where(
+        merged['_merge'] == 'left_only',
+        'No Match in Raw Data',
+        np.where(quantities_match, 'Match', 'Mismatch')
+    )
+    return pd.Categorical(match_status, categories=MATCH_STATUS_CATEGORIES)
+
 def map_ghg_emissions_data(raw_data_df, ingestion_df, ingestion_type):
     """Map GHG Emissions data points between raw data and ingestion files"""
     try:
@@ -284,68 +390,47 @@ def map_ghg_emissions_data(raw_data_df, ingestion_df, ingestion_type):
             # Get the facility column name for ingestion (could be 'Facility Name' or 'Facility')
             ingestion_facility_col = 'Facility Name' if 'Facility Name' in ingestion_df.columns else 'Facility'
             
+            key_columns = [ingestion_facility_col, 'Resource Name', 'Month', 'Year']
+            
+            # Keep only the first raw data row per key (same as taking the first match) and
+            # drop rows with missing keys, which could never match a row in the ingestion file
+            raw_quantities = raw_data_df[['Facility Name', 'Resource Name', 'Month', 'Year', 'Quantity']].rename(
+                columns={'Facility Name': ingestion_facility_col, 'Quantity': 'raw_quantity'}
+            )
+            ingestion_quantities, raw_quantities = _align_key_dtypes(
+                ingestion_df[key_columns + ['Quantity']], raw_quantities, key_columns
+            )
+            # Object columns left by mixed text and numbers cannot be compared with Arrow-backed quantities
+            ingestion_quantities = ingestion_quantities.assign(Quantity=_numeric_quantities(ingestion_quantities['Quantity']))
+            raw_quantities = raw_quantities.assign(raw_quantity=_numeric_quantities(raw_quantities['raw_quantity']))
+            raw_quantities = raw_quantities.dropna(subset=key_columns).drop_duplicates(subset=key_columns)
+            
+            # Left join every ingestion row against the raw data on the key columns
+            merged = ingestion_quantities.merge(
+                raw_quantities, on=key_columns, how='left', indicator=True
+            )
+            
             # Create comparison results
-            comparison_results = []
-            matched_rows = 0
-            unmatched_ingestion_rows = 0
-            quantity_matches = 0
-            quantity_mismatches = 0
+            comparison_results = pd.DataFrame({
+                'facility_name': merged[ingestion_facility_col],
+                'resource_name': merged['Resource Name'],
+                'month': merged['Month'],
+                'year': merged['Year'],
+                'raw_quantity': merged['raw_quantity'],
+                'ingestion_quantity': merged['Quantity'],
+                'difference': merged['raw_quantity'] - merged['Quantity'],
+                'match_status': _match_status(merged, 'Quantity')
+            })
             
-            # Iterate through each row in ingestion file
-            for idx, ingestion_row in ingestion_df.iterrows():
-                facility_name = ingestion_row[ingestion_facility_col]
-                resource_name = ingestion_row['Resource Name']
-                month = ingestion_row['Month']
-                year = ingestion_row['Year']
-                ingestion_quantity = ingestion_row['Quantity']
-                
-                # Find matching row in raw data
-                raw_match = raw_data_df[
-                    (raw_data_df['Facility Name'] == facility_name) &
-                    (raw_data_df['Resource Name'] == resource_name) &
-                    (raw_data_df['Month'] == month) &
-                    (raw_data_df['Year'] == year)
-                ]
-                
-                if not raw_match.empty:
-                    matched_rows += 1
-                    raw_quantity = raw_match.iloc[0]['Quantity']
-                    
-                    # Compare quantities
-                    if raw_quantity == ingestion_quantity:
-                        quantity_matches += 1
-                        match_status = 'Match'
-                    else:
-                        quantity_mismatches += 1
-                        match_status = 'Mismatch'
-                    
-                    comparison_results.append({
-                        'facility_name': facility_name,
-                        'resource_name': resource_name,
-                        'month': month,
-                        'year': year,
-                        'raw_quantity': raw_quantity,
-                        'ingestion_quantity': ingestion_quantity,
-                        'difference': raw_quantity - ingestion_quantity,
-                        'match_status': match_status
-                    })
-                else:
-                    unmatched_ingestion_rows += 1
-                    comparison_results.append({
-                        'facility_name': facility_name,
-                        'resource_name': resource_name,
-                        'month': month,
-                        'year': year,
-                        'raw_quantity': None,
-                        'ingestion_quantity': ingestion_quantity,
-                        'difference': None,
-                        'match_status': 'No Match in Raw Data'
-                    })
+            status_counts = comparison_results['match_status'].value_counts()
+            quantity_matches = int(status_counts.get('Match', 0))
+            quantity_mismatches = int(status_counts.get('Mismatch', 0))
+            unmatched_ingestion_rows = int(status_counts.get('No Match in Raw Data', 0))
             
             return {
                 'ingestion_type': 'Monthly Data in Rows',
                 'total_ingestion_rows': len(ingestion_df),
-                'matched_rows': matched_rows,
+                'matched_rows': quantity_matches + quantity_mismatches,
                 'unmatched_rows': unmatched_ingestion_rows,
                 'quantity_matches': quantity_matches,
                 'quantity_mismatches': quantity_mismatches,
@@ -359,13 +444,6 @@ def map_ghg_emissions_data(raw_data_df, ingestion_df, ingestion_type):
             # Get the facility column name for ingestion (could be 'Facility Name' or 'Facility')
             ingestion_facility_col = 'Facility Name' if 'Facility Name' in ingestion_df.columns else 'Facility'
             
-            # Create comparison results
-            comparison_results = []
-            matched_rows = 0
-            unmatched_ingestion_rows = 0
-            quantity_matches = 0
-            quantity_mismatches = 0
-            
             # Define month name mapping
             month_names = {
                 'Jan': 'January', 'Feb': 'February', 'Mar': 'March', 'Apr': 'April',
@@ -373,13 +451,8 @@ def map_ghg_emissions_data(raw_data_df, ingestion_df, ingestion_type):
                 'Sep': 'September', 'Oct': 'October', 'Nov': 'November', 'Dec': 'December'
             }
             
-            # Debug: Show all columns
-            print("=== DEBUG: Monthly Data in Columns ===")
-            print("All ingestion columns:", list(ingestion_df.columns))
-            
             # Get month columns from ingestion data (format: Mon-YY)
             month_columns = [col for col in ingestion_df.columns if '-' in col and len(col) == 6 and col[:3] in month_names]
-            print("Detected month columns:", month_columns)
             
             # Create dynamic month mapping
             month_mapping = {}
@@ -391,103 +464,61 @@ def map_ghg_emissions_data(raw_data_df, ingestion_df, ingestion_type):
                     'month': month_names[month_abbr],
                     'year': year
                 }
-                print(f"Mapping {col} -> Month: {month_names[month_abbr]}, Year: {year}")
             
-            print("Final month mapping:", month_mapping)
-            print("================================")
+            key_columns = [ingestion_facility_col, 'Resource', 'Month', 'Year']
+            
+            # Unpivot the month columns into one row per ingestion row and month, keeping the
+            # original row order (row by row, months left to right) with a stable sort
+            ingestion_quantities = ingestion_df[[ingestion_facility_col, 'Resource'] + month_columns]
+            melted = ingestion_quantities.assign(_row=np.arange(len(ingestion_quantities))).melt(
+                id_vars=['_row', ingestion_facility_col, 'Resource'],
+                value_vars=month_columns,
+                var_name='month_column',
+                value_name='ingestion_quantity'
+            ).sort_values('_row', kind='stable')
+            
+            # Skip quantities that are null or 0 (text in a quantity column counts as null)
+            melted['ingestion_quantity'] = _numeric_quantities(melted['ingestion_quantity'])
+            melted = melted[melted['ingestion_quantity'].notna() & melted['ingestion_quantity'].ne(0)]
+            melted['Month'] = melted['month_column'].map({col: info['month'] for col, info in month_mapping.items()})
+            melted['Year'] = melted['month_column'].map({col: info['year'] for col, info in month_mapping.items()})
             
-            # Iterate through each row in ingestion file
-            for idx, ingestion_row in ingestion_df.iterrows():
-                facility_name = ingestion_row[ingestion_facility_col]
-                resource_name = ingestion_row['Resource']
-                
-                # Debug: Show first few rows
-                if idx < 2:
-                    print(f"\n--- Processing Row {idx} ---")
-                    print(f"Facility: '{facility_name}'")
-                    print(f"Resource: '{resource_name}'")
-                
-                # Check each month column
-                for month_col in month_columns:
-                    ingestion_quantity = ingestion_row[month_col]
-                    
-                    # Skip if quantity is null or 0
-                    if pd.isna(ingestion_quantity) or ingestion_quantity == 0:
-                        if idx < 2:
-                            print(f"  Skipping {month_col}: {ingestion_quantity} (null or 0)")
-                        continue
-                    
-                    # Get corresponding month and year
-                    month_info = month_mapping[month_col]
-                    month = month_info['month']
-                    year = month_info['year']
-                    
-                    if idx < 2:
-                        print(f"  Checking {month_col}: {ingestion_quantity} -> Month: {month}, Year: {year}")
-                    
-                    # Find matching row in raw data
-                    raw_match = raw_data_df[
-                        (raw_data_df['Facility Name'] == facility_name) &
-                        (raw_data_df['Resource Name'] == resource_name) &
-                        (raw_data_df['Month'] == month) &
-                        (raw_data_df['Year'] == year)
-                    ]
-                    
-                    if idx < 2:
-                        print(f"    Found {len(raw_match)} matches in raw data")
-                        if len(raw_match) > 0:
-                            print(f"    Raw data match: {raw_match[['Facility Name', 'Resource Name', 'Month', 'Year', 'Quantity']].iloc[0].to_dict()}")
-                        else:
-                            # Show what's available in raw data for this facility
-                            facility_matches = raw_data_df[raw_data_df['Facility Name'] == facility_name]
-                            if len(facility_matches) > 0:
-                                print(f"    Available data for facility '{facility_name}':")
-                                print(facility_matches[['Facility Name', 'Resource Name', 'Month', 'Year']].head())
-                            else:
-                                print(f"    No data found for facility '{facility_name}' in raw data")
-                    
-                    if not raw_match.empty:
-                        matched_rows += 1
-                        raw_quantity = raw_match.iloc[0]['Quantity']
-                        
-                        # Compare quantities
-                        if raw_quantity == ingestion_quantity:
-                            quantity_matches += 1
-                            match_status = 'Match'
-                        else:
-                            quantity_mismatches += 1
-                            match_status = 'Mismatch'
-                        
-                        comparison_results.append({
-                            'facility_name': facility_name,
-                            'resource_name': resource_name,
-                            'month': month,
-                            'year': year,
-                            'month_column': month_col,
-                            'raw_quantity': raw_quantity,
-                            'ingestion_quantity': ingestion_quantity,
-                            'difference': raw_quantity - ingestion_quantity,
-                            'match_status': match_status
-                        })
-                    else:
-                        unmatched_ingestion_rows += 1
-                        comparison_results.append({
-                            'facility_name': facility_name,
-                            'resource_name': resource_name,
-                            'month': month,
-                            'year': year,
-                            'month_column': month_col,
-                            'raw_quantity': None,
-                            'ingestion_quantity': ingestion_quantity,
-                            'difference': None,
-                            'match_status': 'No Match in Raw Data'
-                        })
+            # Keep only the first raw data row per key (same as taking the first match) and
+            # drop rows with missing keys, which could never match a row in the ingestion file
+            raw_quantities = raw_data_df[['Facility Name', 'Resource Name', 'Month', 'Year', 'Quantity']].rename(
+                columns={'Facility Name': ingestion_facility_col, 'Resource Name': 'Resource', 'Quantity': 'raw_quantity'}
+            )
+            # The ingestion Year comes from the month column names, so a raw data Year stored as text is read as a number
+            melted, raw_quantities = _align_key_dtypes(melted, raw_quantities, key_columns)
+            raw_quantities = raw_quantities.assign(raw_quantity=_numeric_quantities(raw_quantities['raw_quantity']))
+            raw_quantities = raw_quantities.dropna(subset=key_columns).drop_duplicates(subset=key_columns)
+            
+            # Left join every ingestion quantity against the raw data on the key columns
+            merged = melted.merge(raw_quantities, on=key_columns, how='left', indicator=True)
+            
+            # Create comparison results
+            comparison_results = pd.DataFrame({
+                'facility_name': merged[ingestion_facility_col],
+                'resource_name': merged['Resource'],
+                'month': merged['Month'],
+                'year': merged['Year'],
+                'month_column': merged['month_column'],
+                'raw_quantity': merged['raw_quantity'],
+                'ingestion_quantity': merged['ingestion_quantity'],
+                'difference': merged['raw_quantity'] - merged['ingestion_quantity'],
+                'match_status': _match_status(merged, 'ingestion_quantity')
+            })
+            
+            status_counts = comparison_results['match_status'].value_counts()
+            quantity_matches = int(status_counts.get('Match', 0))
+            quantity_mismatches = int(status_counts.get('Mismatch', 0))
+            unmatched_ingestion_rows = int(status_counts.get('No Match in Raw Data', 0))
             
             return {
                 'ingestion_type': 'Monthly Data in Columns',
                 'total_ingestion_rows': len(ingestion_df),
                 'total_comparisons': len(comparison_results),
-                'matched_rows': matched_rows,
+                'matched_rows': quantity_matches + quantity_mismatches,
                 'unmatched_rows': unmatched_ingestion_rows,
                 'quantity_matches': quantity_matches,
                 'quantity_mismatches': quantity_mismatches,
@@ -519,10 +550,13 @@ def compare_ghg_emissions_data(raw_data_df, ingestion_df, ingestion_type):
 
 def generate_comparison_report(raw_data_df, ingestion_df):
     """Generate comprehensive comparison report"""
+    # Identify the ingestion file type once and share it with both analyses
+    ingestion_type = identify_ingestion_file_type(ingestion_df)
+    
     report = {
         'timestamp': datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-        'basic_comparison': compare_dataframes(raw_data_df, ingestion_df),
-        'data_quality_issues': analyze_data_quality(raw_data_df, ingestion_df),
+        'basic_comparison': compare_dataframes(raw_data_df, ingestion_df, ingestion_type, include_missing_lists=False),
+        'data_quality_issues': analyze_data_quality(raw_data_df, ingestion_df, ingestion_type),
         'discrepancies': find_data_discrepancies(raw_data_df, ingestion_df)
     }
     
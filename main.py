@@ -1,8 +1,11 @@
 import streamlit as st
 import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 from comparison_logic import (
     compare_dataframes,
     analyze_data_quality,
+    convert_key_columns_to_categorical,
     identify_resource_type,
     create_duplicate_rows_excel
 )
@@ -10,7 +13,10 @@ from utility_functions import (
     read_excel_file,
     get_excel_sheets,
     identify_file_types,
-    display_comparison_results
+    display_comparison_results,
+    excel_download_button,
+    init_excel_cache,
+    clear_excel_cache
 )
 
 def main():
@@ -40,13 +46,20 @@ def main():
         key="file2"
     )
 
+    # Uploaded files are parsed once and cached; allow forcing a fresh read
+    if st.sidebar.button("🔄 Reload Files"):
+        clear_excel_cache()
+
     # Main content area
     if file1 is not None and file2 is not None:
         st.success("✅ Both files uploaded successfully!")
 
-        # Try to read the files
-        df1, error1 = read_excel_file(file1)
-        df2, error2 = read_excel_file(file2)
+        # Try to read the files concurrently (reads are cached across reruns);
+        # the workers get the script run context so they can reach the session's workbook cache,
+        # which is created here first so the two workers do not each create their own
+        init_excel_cache()
+        with ThreadPoolExecutor(max_workers=2, initializer=add_script_run_ctx, initargs=(None, get_script_run_ctx())) as executor:
+            (df1, error1), (df2, error2) = executor.map(read_excel_file, (file1, file2))
         
         if error1:
             st.error(f"❌ Error reading File 1: {error1}")
@@ -64,16 +77,16 @@ def main():
         col1, col2 = st.columns(2)
         
         with col1:
-            st.info(f"**Raw Data File:** {file_types['raw_data']['name']}")
-            st.write(f"Size: {file_types['raw_data']['file'].size:,} bytes")
+            st.info(f"**Raw Data File:** {file_types.raw_data.name}")
+            st.write(f"Size: {file_types.raw_data.file.size:,} bytes")
             
         with col2:
-            st.info(f"**Ingestion File:** {file_types['ingestion']['name']}")
-            st.write(f"Size: {file_types['ingestion']['file'].size:,} bytes")
+            st.info(f"**Ingestion File:** {file_types.ingestion.name}")
+            st.write(f"Size: {file_types.ingestion.file.size:,} bytes")
         
         # Handle multiple sheets in raw data file
-        raw_data_file = file_types['raw_data']['file']
-        ingestion_file = file_types['ingestion']['file']
+        raw_data_file = file_types.raw_data.file
+        ingestion_file = file_types.ingestion.file
         
         # Get sheets from raw data file
         raw_sheets, sheet_error = get_excel_sheets(raw_data_file)
@@ -106,11 +119,8 @@ def main():
             st.error("❌ Could not identify first sheet in ingestion file")
             return
         
-        # Read ingestion sheet
-        ingestion_df, error = read_excel_file(ingestion_file, ingestion_first_sheet)
-        if error:
-            st.error(f"❌ Error reading first sheet from ingestion: {error}")
-            return
+        # Ingestion sheet is the first sheet, which was already read above
+        ingestion_df = file_types.ingestion.df
         
         # Identify resource type and get appropriate raw data sheet
         resource_type = identify_resource_type(ingestion_df)
@@ -139,11 +149,14 @@ def main():
                 return
             st.warning(f"⚠️ Unknown resource type '{resource_type}', using first sheet: {raw_data_sheet}")
         
-        # Read raw data sheet
-        raw_df, error = read_excel_file(raw_data_file, raw_data_sheet)
-        if error:
-            st.error(f"❌ Error reading {raw_data_sheet} sheet from raw data: {error}")
-            return
+        # Read raw data sheet (the first sheet was already read above)
+        if raw_data_sheet == raw_sheets[0]:
+            raw_df = file_types.raw_data.df
+        else:
+            raw_df, error = read_excel_file(raw_data_file, raw_data_sheet)
+            if error:
+                st.error(f"❌ Error reading {raw_data_sheet} sheet from raw data: {error}")
+                return
         
         # Display sheet previews
         st.subheader("📋 Sheet Previews")
@@ -159,12 +172,15 @@ def main():
             st.dataframe(ingestion_df.head())
             st.write(f"Rows: {len(ingestion_df)}, Columns: {len(ingestion_df.columns)}")
         
+        # Share categories between the facility/resource columns of both files so they compare as integer codes
+        convert_key_columns_to_categorical(raw_df, ingestion_df)
+        
         # Detailed comparison
         comparison_results = compare_dataframes(raw_df, ingestion_df)
         display_comparison_results(comparison_results)
         
         # Data quality analysis
-        quality_data = analyze_data_quality(raw_df, ingestion_df)
+        quality_data = analyze_data_quality(raw_df, ingestion_df, comparison_results['ingestion_file_type'])
         quality_issues = quality_data['quality_issues']
         duplicate_rows = quality_data['duplicate_rows']
         
@@ -182,12 +198,7 @@ def main():
                 # Download button for duplicate rows
                 excel_data = create_duplicate_rows_excel(duplicate_rows)
                 if excel_data:
-                    st.download_button(
-                        label="📥 Download Duplicate Rows Excel",
-                        data=excel_data,
-                        file_name="duplicate_rows.xlsx",
-                        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                    )
+                    excel_download_button("📥 Download Duplicate Rows Excel", excel_data, "duplicate_rows.xlsx")
         else:
             st.success("✅ No data quality issues detected!")
             
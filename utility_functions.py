@@ -1,49 +1,198 @@
 import streamlit as st
 import pandas as pd
+import pyarrow as pa
+import hashlib
+import threading
+import zipfile
+import xml.etree.ElementTree as ET
+from collections import namedtuple
+from streamlit.runtime.uploaded_file_manager import UploadedFile
 from comparison_logic import create_missing_facilities_excel
 
+# Session state key for workbooks opened from uploaded files, keyed by (name, size, file id)
+EXCEL_WORKBOOKS_STATE_KEY = 'excel_workbooks'
+MAX_CACHED_WORKBOOKS = 4
+
+# Guards the workbook cache, which the two file reads in main.py update from worker threads
+_excel_workbooks_lock = threading.Lock()
+
+# Namespace of the sheet list in an XLSX file's xl/workbook.xml
+SPREADSHEETML_NAMESPACE = {'m': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'}
+
+# Uploaded file with its DataFrame, and the raw data / ingestion pair returned by identify_file_types
+FileEntry = namedtuple('FileEntry', 'file df name type')
+FilePair = namedtuple('FilePair', 'raw_data ingestion')
+
+# Maximum number of missing facilities shown in the preview table
+MAX_MISSING_PREVIEW_ROWS = 500
+
+# Arrow types of the comparison results columns, so the results tables are converted without type inference
+COMPARISON_RESULTS_ARROW_TYPES = {
+    'facility_name': pa.string(),
+    'resource_name': pa.string(),
+    'month': pa.string(),
+    'year': pa.int64(),
+    'month_column': pa.string(),
+    'raw_quantity': pa.float64(),
+    'ingestion_quantity': pa.float64(),
+    'difference': pa.float64(),
+    'match_status': pa.dictionary(pa.int8(), pa.string())
+}
+
 # =============================================================================
 # UTILITY FUNCTIONS
 # =============================================================================
 
+def _open_excel_file(file):
+    """Open Excel file with the Rust-based calamine engine, falling back to pandas' default engine"""
+    try:
+        return pd.ExcelFile(file, engine='calamine')
+    except (ImportError, ValueError):
+        # python-calamine is not installed (or pandas is too old to know the engine)
+        if hasattr(file, 'seek'):
+            file.seek(0)
+        return pd.ExcelFile(file)
+
+def _parse_sheet(excel_file, sheet_name=0):
+    """Parse a sheet and convert the columns holding a single type to Arrow-backed dtypes"""
+    df = excel_file.parse(sheet_name)
+    try:
+        # Columns mixing numbers and text (e.g. a Quantity of 'TBD') are left as Python objects, as parsed
+        return df.convert_dtypes(dtype_backend='pyarrow')
+    except ImportError:
+        return df
+
+def init_excel_cache():
+    """Create the session's workbook cache; call from the script thread before reading files in worker threads"""
+    st.session_state.setdefault(EXCEL_WORKBOOKS_STATE_KEY, {})
+
+def _get_cached_excel_file(file):
+    """Return the opened workbook for an uploaded file, reusing the one opened on an earlier rerun"""
+    workbooks = st.session_state.setdefault(EXCEL_WORKBOOKS_STATE_KEY, {})
+    key = (file.name, file.size, getattr(file, 'file_id', None))
+    if key not in workbooks:
+        excel_file = _open_excel_file(file)
+        with _excel_workbooks_lock:
+            # Drop the oldest workbooks so replaced uploads do not stay in memory
+            while len(workbooks) >= MAX_CACHED_WORKBOOKS:
+                workbooks.pop(next(iter(workbooks)))
+            workbooks[key] = excel_file
+    return workbooks[key]
+
+def _uploaded_file_key(file):
+    """Hash key for uploaded files: identity plus a digest of the first 64 KB (avoids hashing the whole upload)"""
+    return (file.name, file.size, getattr(file, 'file_id', None), hashlib.md5(file.getbuffer()[:65536]).hexdigest())
+
+@st.cache_data(show_spinner=False, max_entries=8, hash_funcs={UploadedFile: _uploaded_file_key})
 def read_excel_file(file, sheet_name=None):
-    """Read Excel file and return DataFrame"""
+    """Read Excel file and return DataFrame (cached across reruns)"""
     try:
-        if sheet_name:
-            df = pd.read_excel(file, sheet_name=sheet_name)
+        if isinstance(file, UploadedFile):
+            df = _parse_sheet(_get_cached_excel_file(file), sheet_name or 0)
         else:
-            df = pd.read_excel(file)
+            with _open_excel_file(file) as excel_file:
+                df = _parse_sheet(excel_file, sheet_name or 0)
         return df, None
     except Exception as e:
         return None, str(e)
 
+def _read_sheet_names_from_zip(file):
+    """Read sheet names straight from the workbook.xml inside an XLSX file, without opening the workbook"""
+    try:
+        with zipfile.ZipFile(file) as z:
+            root = ET.fromstring(z.read('xl/workbook.xml'))
+        return [sheet.get('name') for sheet in root.findall('.//m:sheet', SPREADSHEETML_NAMESPACE)]
+    finally:
+        if hasattr(file, 'seek'):
+            file.seek(0)
+
+@st.cache_data(show_spinner=False, max_entries=8, hash_funcs={UploadedFile: _uploaded_file_key})
 def get_excel_sheets(file):
-    """Get list of sheet names from Excel file"""
+    """Get list of sheet names from Excel file (cached across reruns)"""
     try:
-        excel_file = pd.ExcelFile(file)
-        return excel_file.sheet_names, None
+        sheet_names = _read_sheet_names_from_zip(file)
+        if sheet_names and None not in sheet_names:
+            return sheet_names, None
+    except Exception:
+        pass
+    
+    # Not an XLSX file (e.g. legacy .xls) or no sheet names found in workbook.xml (e.g. a Strict OOXML
+    # namespace), so open the workbook to list its sheets
+    try:
+        if isinstance(file, UploadedFile):
+            return _get_cached_excel_file(file).sheet_names, None
+        with _open_excel_file(file) as excel_file:
+            return excel_file.sheet_names, None
     except Exception as e:
         return None, str(e)
 
+def clear_excel_cache():
+    """Forget all cached workbooks, sheet lists and DataFrames so files are read again"""
+    read_excel_file.clear()
+    get_excel_sheets.clear()
+    st.session_state.pop(EXCEL_WORKBOOKS_STATE_KEY, None)
+
 def identify_file_types(file1, file2, df1, df2):
     """Identify which file is raw data (larger) and which is ingestion (smaller)"""
-    file1_size = file1.size
-    file2_size = file2.size
+    # Determine based on file size (the larger file is the raw data file); the DataFrames only hold
+    # the first sheet of each file, so their row counts are used only to break a tie in size
+    first, second = (file1, df1), (file2, df2)
+    size1, size2 = file1.size, file2.size
+    first_is_raw = size1 > size2 if size1 != size2 else len(df1.index) > len(df2.index)
+    raw_data, ingestion = (first, second) if first_is_raw else (second, first)
     
-    # Determine based on file size and row count
-    if file1_size > file2_size:
-        return {
-            'raw_data': {'file': file1, 'df': df1, 'name': file1.name, 'type': 'Raw Data File'},
-            'ingestion': {'file': file2, 'df': df2, 'name': file2.name, 'type': 'Ingestion File'}
-        }
+    return FilePair(
+        raw_data=FileEntry(*raw_data, raw_data[0].name, 'Raw Data File'),
+        ingestion=FileEntry(*ingestion, ingestion[0].name, 'Ingestion File')
+    )
+
+@st.fragment
+def excel_download_button(label, excel_data, file_name):
+    """Excel download button in its own fragment, so clicking it does not rerun the rest of the page"""
+    st.download_button(
+        label=label,
+        data=excel_data,
+        file_name=file_name,
+        mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+    )
+
+@st.fragment
+def missing_facilities_download(missing_facilities):
+    """Build the missing facilities Excel file only when asked for, rerunning just this fragment"""
+    if not st.button("📄 Prepare Missing Facilities Excel"):
+        return
+    
+    excel_data = create_missing_facilities_excel(missing_facilities)
+    if excel_data:
+        # Clicking the download button does not rerun the fragment, so the button stays in place
+        st.download_button(
+            label="📥 Download Missing Facilities Excel",
+            data=excel_data,
+            file_name="missing_facilities.xlsx",
+            mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            on_click="ignore"
+        )
     else:
-        return {
-            'raw_data': {'file': file2, 'df': df2, 'name': file2.name, 'type': 'Raw Data File'},
-            'ingestion': {'file': file1, 'df': df1, 'name': file1.name, 'type': 'Ingestion File'}
-        }
+        st.error("❌ Could not create the missing facilities Excel file")
+
+def _comparison_results_to_arrow(results_df):
+    """Convert comparison results to an Arrow table with the fixed column types, or return the DataFrame if the data does not fit"""
+    try:
+        schema = pa.schema([(col, COMPARISON_RESULTS_ARROW_TYPES[col]) for col in results_df.columns])
+        return pa.Table.from_pandas(results_df, schema=schema, preserve_index=False)
+    except (KeyError, pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        # Unexpected column or value (e.g. a text Year), so leave the conversion to st.dataframe,
+        # which also fixes up column types Arrow cannot infer on its own
+        return results_df
+
+def display_summary_table(counts):
+    """Display a {label: count} dict as a one-row table, sent to the page as a single element"""
+    summary = pd.DataFrame([counts])
+    st.table(summary.style.format('{:,}').hide(axis='index'))
 
+@st.fragment
 def display_comparison_results(results):
-    """Display detailed comparison results"""
+    """Display detailed comparison results (as a fragment, so its widgets only rerun this panel)"""
     st.subheader("📈 Detailed Analysis")
     
     # Resource Type and File Type Information
@@ -65,39 +214,30 @@ def display_comparison_results(results):
     if 'error' in facility_data:
         st.error(f"❌ {facility_data['error']}")
     else:
-        # Facility metrics
-        col1, col2, col3, col4 = st.columns(4)
-        with col1:
-            st.metric("Raw Data Facilities", facility_data.get('raw_facilities_count', 0))
-        with col2:
-            st.metric("Ingestion Facilities", facility_data.get('ingestion_facilities_count', 0))
-        with col3:
-            st.metric("Common Facilities", facility_data.get('common_facilities_count', 0))
-        with col4:
-            missing_count = facility_data.get('missing_in_raw_count', 0)
-            st.metric("Missing in Raw Data", missing_count, delta=f"-{missing_count}" if missing_count > 0 else None)
+        # Facility counts (read once as plain ints), shown as a single summary table
+        facility_counts = {
+            label: int(facility_data.get(key, 0)) for label, key in (
+                ("Raw Data Facilities", 'raw_facilities_count'),
+                ("Ingestion Facilities", 'ingestion_facilities_count'),
+                ("Common Facilities", 'common_facilities_count'),
+                ("Missing in Raw Data", 'missing_in_raw_count')
+            )
+        }
+        display_summary_table(facility_counts)
         
         # Missing facilities details
-        missing_facilities = facility_data.get('missing_in_raw', [])
-        if missing_facilities:
+        missing_facilities = facility_data.get('missing_in_raw', pd.Index([]))
+        if len(missing_facilities) > 0:
             st.warning(f"⚠️ Found {len(missing_facilities)} facilities in ingestion file that are NOT in raw data:")
             
-            # Display missing facilities
-            missing_df = pd.DataFrame({
-                'Missing Facilities': missing_facilities,
-                'Status': 'Not Found in Raw Data'
-            })
+            # Display missing facilities (the preview is capped, the download has every facility)
+            missing_df = missing_facilities[:MAX_MISSING_PREVIEW_ROWS].to_frame(index=False, name='Missing Facilities').assign(Status='Not Found in Raw Data')
             st.dataframe(missing_df, use_container_width=True)
+            if len(missing_facilities) > MAX_MISSING_PREVIEW_ROWS:
+                st.caption(f"Showing the first {MAX_MISSING_PREVIEW_ROWS:,} of {len(missing_facilities):,} missing facilities")
             
-            # Download button for missing facilities
-            excel_data = create_missing_facilities_excel(missing_facilities)
-            if excel_data:
-                st.download_button(
-                    label="📥 Download Missing Facilities Excel",
-                    data=excel_data,
-                    file_name="missing_facilities.xlsx",
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-                )
+            # Download button for missing facilities (the Excel file is only built when asked for)
+            missing_facilities_download(missing_facilities)
         else:
             st.success("✅ All facilities in ingestion file are present in raw data!")
     
@@ -116,38 +256,59 @@ def display_comparison_results(results):
             # Display detailed comparison results
             mapping = resource_comparison.get('mapping', {})
             if mapping and 'error' not in mapping:
-                # Show summary metrics
+                # Show summary counts (read once as plain ints) as a single summary table
+                summary_counts = {
+                    label: int(mapping.get(key, 0)) for label, key in (
+                        ("Total Ingestion Rows", 'total_ingestion_rows'),
+                        ("Matched Rows", 'matched_rows'),
+                        ("Quantity Matches", 'quantity_matches'),
+                        ("Quantity Mismatches", 'quantity_mismatches')
+                    )
+                }
                 st.write("**Comparison Summary:**")
-                col1, col2, col3, col4 = st.columns(4)
-                
-                with col1:
-                    st.metric("Total Ingestion Rows", mapping.get('total_ingestion_rows', 0))
-                with col2:
-                    st.metric("Matched Rows", mapping.get('matched_rows', 0))
-                with col3:
-                    st.metric("Quantity Matches", mapping.get('quantity_matches', 0))
-                with col4:
-                    st.metric("Quantity Mismatches", mapping.get('quantity_mismatches', 0))
+                display_summary_table(summary_counts)
                 
                 # Show detailed comparison results
-                comparison_results = mapping.get('comparison_results', [])
-                if comparison_results:
+                comparison_results = mapping.get('comparison_results', pd.DataFrame())
+                if len(comparison_results) > 0:
                     st.subheader("📊 Detailed Comparison Results")
                     
-                    # Create DataFrame for display
-                    results_df = pd.DataFrame(comparison_results)
+                    # Comparison results already arrive as a DataFrame with a categorical match status;
+                    # it is converted to Arrow once (when it fits the fixed column types) and the tables below are filtered from that
+                    results_df = comparison_results
+                    results_table = _comparison_results_to_arrow(results_df)
+                    
+                    # Split mismatches and no matches by their match status
+                    match_status = results_df['match_status']
+                    mismatch_mask = match_status.eq('Mismatch').to_numpy(dtype=bool)
+                    no_match_mask = match_status.eq('No Match in Raw Data').to_numpy(dtype=bool)
+                    if isinstance(results_table, pa.Table):
+                        mismatches = results_table.filter(pa.array(mismatch_mask))
+                        no_matches = results_table.filter(pa.array(no_match_mask))
+                    else:
+                        mismatches = results_df[mismatch_mask]
+                        no_matches = results_df[no_match_mask]
                     
-                    # Display the results table
-                    st.dataframe(results_df, use_container_width=True)
+                    # Show all results, mismatches and no matches in tabs, one table per tab
+                    tab_all, tab_mismatches, tab_no_matches = st.tabs([
+                        f"All ({len(results_df)})",
+                        f"Mismatches ({len(mismatches)})",
+                        f"No Match in Raw Data ({len(no_matches)})"
+                    ])
                     
-                    # Show mismatches and no matches separately
-                    mismatches = results_df[results_df['match_status'] == 'Mismatch']
-                    no_matches = results_df[results_df['match_status'] == 'No Match in Raw Data']
+                    with tab_all:
+                        st.dataframe(results_table, use_container_width=True)
                     
-                    if not mismatches.empty:
-                        st.warning(f"⚠️ Found {len(mismatches)} quantity mismatches:")
-                        st.dataframe(mismatches, use_container_width=True)
+                    with tab_mismatches:
+                        if len(mismatches) > 0:
+                            st.warning(f"⚠️ Found {len(mismatches)} quantity mismatches:")
+                            st.dataframe(mismatches, use_container_width=True)
+                        else:
+                            st.success("✅ No quantity mismatches found!")
                     
-                    if not no_matches.empty:
-                        st.error(f"❌ Found {len(no_matches)} rows in ingestion that don't exist in raw data:")
-                        st.dataframe(no_matches, use_container_width=True)
+                    with tab_no_matches:
+                        if len(no_matches) > 0:
+                            st.error(f"❌ Found {len(no_matches)} rows in ingestion that don't exist in raw data:")
+                            st.dataframe(no_matches, use_container_width=True)
+                        else:
+                            st.success("✅ All ingestion rows exist in raw data!")